@@ -14,6 +14,9 @@
 #Features:
 
 # - extract from Oracle and load to S3
+# - write Oracle extracts as delimited text or as Parquet (outputfile_format in diConfig.ini)
+# - split Oracle extracts into part files that are loaded to S3 while extraction continues, with a manifest
+# - optionally spread backups and folder2folder copies over hash-derived S3 prefixes (s3_key_layout in diConfig.ini)
 # - load files that are already spooled by Oracle to S3
 # - back up loaded files to another S3 location
 # - back up loaded files to a local location
@@ -36,6 +39,7 @@
 #run on command line:
 #pip install <moodule name>
 #Eg: pip install boto3
+#pyarrow is only needed when outputfile_format = parquet (pip install pyarrow)
 
 
 #Author: Raj Samuel
@@ -59,11 +63,26 @@ import datetime
 import logging
 import sys
 import platform
+import io
+import json
+import hashlib
+import decimal
+import glob
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 if platform.system() != 'AIX':
     from cryptography.fernet import Fernet
     import cx_Oracle as cxoracle
 
+try:
+    #Only needed for outputfile_format = parquet. checkForInvalidConfig() complains if it's missing when needed.
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
 
 class dataInterface:
 
@@ -146,6 +165,13 @@ class dataInterface:
             self._s3_backup_storage_class = self._config.get(config_section,'s3_backup_storage_class')
             self._s3 = None
 
+            #Initialize S3 key layout for backups and folder2folder copies: date (base/year/month/day/..) or hashed (base/shard/year/month/day/..)
+            self._s3_key_layout = self._config.get(config_section,'s3_key_layout').strip().lower()
+            self._s3_key_shards = int(self._config.get(config_section,'s3_key_shards'))
+            #Key index entries written by this run. Each run writes its own index objects, named by a run id that sorts by start time.
+            self._s3_key_index_run_id = datetime.datetime.now().strftime('%Y%m%dT%H%M%S%f') + '-' + platform.node() + '-' + str(os.getpid())
+            self._s3_key_index_dict = {}
+
             #Initialize Oracle parameters and oracle object
             self._oracle_user_name = self._config.get(config_section,'oracle_user_name')
             self._oracle_password_token = self._config.get(config_section,'oracle_password')
@@ -174,6 +200,25 @@ class dataInterface:
             else:
                 self._file_fmt_header = False
 
+            #Initialize output file format: delimited text or Parquet
+            self._outputfile_format = self._config.get(config_section,'outputfile_format').strip().lower()
+            self._parquet_row_group_size = int(self._config.get(config_section,'parquet_row_group_size'))
+            #parquet_compression is a default codec optionally followed by per column overrides. Eg: snappy,NOTES:zstd,ID:none
+            self._parquet_default_codec = 'snappy'
+            self._parquet_column_codecs = {}
+            for codec_item in self._config.get(config_section,'parquet_compression').split(','):
+                codec_item = codec_item.strip()
+                if ':' in codec_item:
+                    self._parquet_column_codecs[codec_item.split(':')[0].strip().upper()] = codec_item.split(':')[1].strip().lower()
+                elif codec_item != '':
+                    self._parquet_default_codec = codec_item.lower()
+            #parquet_unconstrained_number is string, double or decimal(p,s). For decimal, precision and scale are kept as a tuple.
+            self._parquet_unconstrained_number = self._config.get(config_section,'parquet_unconstrained_number').strip().lower().replace(' ','')
+            self._parquet_unconstrained_decimal = None
+            unconstrained_decimal = re.match(r'^decimal\((\d+),(\d+)\)$', self._parquet_unconstrained_number)
+            if unconstrained_decimal:
+                self._parquet_unconstrained_decimal = (int(unconstrained_decimal.group(1)), int(unconstrained_decimal.group(2)))
+
             #Initialize Oracle's output filenames into a dictionary. This is also S3's input.
             self._sql_output_file_dict = {}
             
@@ -203,6 +248,31 @@ class dataInterface:
                     if re.match('spooled_outputfile_from_oracle_[0-9]+',name):
                         self._sql_output_file_dict[name] = value
 
+            #Parquet output files are compressed internally, so they are never gzipped (see getUploadExtension())
+            self._parquet_output_files = set()
+            if self._oracle_spooling == False and self._outputfile_format == 'parquet':
+                self._parquet_output_files.update(self._sql_output_file_dict.values())
+
+            #Initialize chunked output. When either limit is set, extracts are split into <file>.partNNNNN files and each
+            #part is loaded to S3 as soon as it's complete. Not applicable to spooled files.
+            self._chunk_rows = int(self._config.get(config_section,'outputfile_chunk_rows'))
+            self._chunk_bytes = int(float(self._config.get(config_section,'outputfile_chunk_mb')) * 1000000)
+            if self._oracle_spooling == False and (self._chunk_rows > 0 or self._chunk_bytes > 0):
+                self._output_chunking = True
+            else:
+                self._output_chunking = False
+            #Part files (and their row counts and uploads) of each chunked output file. Filled in by extractOracleToFile().
+            self._chunked_output_parts = {}
+            self._chunk_uploader = None
+            #and delete part files (and their .gz) from last run, which may have had more parts than this run will
+            if self._oracle_spooling == False:
+                for value in self._sql_output_file_dict.values():
+                    for last_run_part in glob.glob(self.getChunkFilePattern(value)) + glob.glob(self.getChunkFilePattern(value) + '.gz'):
+                        try:
+                            os.remove(last_run_part)
+                        except OSError as ose:
+                            logging.warning(ose)
+                            #not raising this since it's not critical
                               
             #Initialize S3 folder names.
             self._s3_folder_dict = {}
@@ -258,6 +328,18 @@ class dataInterface:
             if self._folder2folder_copy == True:
                 assert self._path_delim in self._folder2folder_source_folder, "Terminating. Review path given for the source of folder2folder copy: \"%s\" in diConfig.ini" % self._folder2folder_source_folder
                 assert self._folder2folder_target_s3_basefolder[-1] != '/', "Terminating. S3 folder name \"%s\" for folder2folder copy ends with unexpected / in diConfig.ini" % self._folder2folder_target_s3_basefolder
+            assert self._s3_key_layout in ['date', 'hashed'], "Terminating. Unknown s3_key_layout \"%s\" in diConfig.ini. Expected date or hashed." % self._s3_key_layout
+            if self._s3_key_layout == 'hashed':
+                assert self._s3_key_shards > 0, "Terminating. s3_key_shards must be greater than 0 in diConfig.ini"
+            assert self._chunk_rows >= 0 and self._chunk_bytes >= 0, "Terminating. outputfile_chunk_rows and outputfile_chunk_mb can't be negative in diConfig.ini"
+            assert self._outputfile_format in ['delimited', 'parquet'], "Terminating. Unknown outputfile_format \"%s\" in diConfig.ini. Expected delimited or parquet." % self._outputfile_format
+            if self._outputfile_format == 'parquet' and self._oracle_spooling == False:
+                assert self._oracle_sqlplus_connection is False, "Terminating. outputfile_format = parquet needs cx_Oracle, it can't be used with oracle_sqlplus_connection = true in diConfig.ini"
+                assert pa is not None, "Terminating. outputfile_format = parquet needs pyarrow package. Run: pip install pyarrow"
+                assert self._parquet_row_group_size > 0, "Terminating. parquet_row_group_size must be greater than 0 in diConfig.ini"
+                for codec in [self._parquet_default_codec] + list(self._parquet_column_codecs.values()):
+                    assert codec in ['none', 'snappy', 'gzip', 'brotli', 'lz4', 'zstd'], "Terminating. Unknown codec \"%s\" in parquet_compression in diConfig.ini" % codec
+                assert self._parquet_unconstrained_number in ['string', 'double'] or (self._parquet_unconstrained_decimal is not None and 0 < self._parquet_unconstrained_decimal[0] <= 38 and self._parquet_unconstrained_decimal[1] <= self._parquet_unconstrained_decimal[0]), "Terminating. Unknown parquet_unconstrained_number \"%s\" in diConfig.ini. Expected string, double or decimal(p,s) with p <= 38 and s <= p." % self._parquet_unconstrained_number
       
             #Loop through S3 folder names. Same folder name can be the target for more than one file.
             for folder_var,folder_name in self._s3_folder_dict.items():
@@ -320,6 +402,14 @@ class dataInterface:
                 shutil.copyfileobj(unzippd,zippd)
 
                 
+    def getUploadExtension(self, filename_with_path):
+        #Returns the extension a data file gets before it's loaded to S3: .gz if it's going to be compressed, else nothing.
+        #Parquet files are not gzipped. They are already compressed internally and Athena/Spark can't split a gzipped Parquet file.
+        if self._s3_file_compress == True and filename_with_path not in self._parquet_output_files:
+            return '.gz'
+        return ''
+
+                
     def stripFilenameFromPath(self,filename_with_path):
         #Strip local path from file name to make up S3 object name aka S3 key.
         assert self._path_delim in filename_with_path, "File path has unrecognized slash or missing path. Check diConfig.ini. Expected %r ." % self._path_delim
@@ -359,15 +449,14 @@ class dataInterface:
                 s3_file = self._sql_output_file_dict['outputfile_of_sql_stmt_1']
         
         #If S3 compression is enabled, compress the file
-        if self._s3_file_compress == True:
+        gzfile_extn = self.getUploadExtension(s3_file)
+        if gzfile_extn == '.gz':
             logging.info("Compression is enabled. Data files will be compressed to gzip format.")
             self.gzCompressFile(s3_file)
-            gzfile_extn = '.gz'
-                
-        else:
-            gzfile_extn = ''
         no_path_filename = self.stripFilenameFromPath(s3_file)
         s3_key = s3_folder + '/' + no_path_filename + gzfile_extn
+        #Size of the object as loaded to S3. Returned to the caller (used for the manifest of chunked output).
+        s3_object_size = os.path.getsize(s3_file+gzfile_extn)
         
         #Moment of truth..
         try:            
@@ -389,12 +478,13 @@ class dataInterface:
             raise
 
         try:
-            #Delete the compressed local copy that was loaded to S3. Don't do anything if compression is disabled, retaining original data files.
-            if self._s3_file_compress == True:
+            #Delete the compressed local copy that was loaded to S3. Don't do anything if compression is disabled (or file is Parquet), retaining original data files.
+            if gzfile_extn == '.gz':
                 os.remove(s3_file+gzfile_extn)
         except OSError as ose:
             logging.warning(ose)
             #Not raising this since it's not critical
+        return s3_object_size
 
 
     def writeObjectsToS3(self):
@@ -404,9 +494,77 @@ class dataInterface:
             for varname, file_name in self._sql_output_file_dict.items():
                 file_number = varname.split('_')[4].strip()
                 if folder_number == file_number:
+                    if file_name in self._chunked_output_parts:
+                        logging.info("%s was loaded to S3 in parts during extraction. Nothing more to load.", file_name)
+                        break
                     self.writeOneObjectToS3(folder_name,file_name)
                     break
 
+
+    def listS3Keys(self, bucket_name, prefix):
+        #Returns all keys under prefix. list_objects_v2 returns at most 1000 keys per call, hence the paginator.
+        keys = []
+        for page in self._s3.meta.client.get_paginator('list_objects_v2').paginate(Bucket=bucket_name, Prefix=prefix):
+            for s3_object in page.get('Contents', []):
+                keys.append(s3_object['Key'])
+        return keys
+
+    def getPhysicalS3Key(self, s3_basefolder, logical_key):
+        #With s3_key_layout = hashed, keys under s3_basefolder are spread over s3_key_shards prefixes so that many parallel
+        #writers don't all hit one hot S3 prefix: base/year/month/day/.. becomes base/<shard>/year/month/day/..
+        #The shard only depends on the logical key, so it can always be recomputed without listing the shards.
+        #With s3_key_layout = date the logical key is returned as is.
+        if self._s3_key_layout != 'hashed':
+            return logical_key
+        shard_number = int(hashlib.md5(logical_key.encode('utf-8')).hexdigest(), 16) % self._s3_key_shards
+        shard = format(shard_number, 'x').zfill(len(format(self._s3_key_shards - 1, 'x')))
+        return s3_basefolder + '/' + shard + logical_key[len(s3_basefolder):]
+
+
+    def getS3KeyIndexPrefix(self, s3_basefolder, logical_key):
+        #The index of a hashed layout lives in the (logical) date folder of the keys it maps: base/year/month/day/_key_index/
+        #Each run writes its own <run id>.json under it, so parallel runs never overwrite each other's entries.
+        return s3_basefolder + '/' + '/'.join(logical_key[len(s3_basefolder)+1:].split('/')[:3]) + '/_key_index/'
+
+
+    def getS3KeyIndex(self, bucket_name, index_prefix):
+        #Returns the logical key -> physical key mapping of all index objects under index_prefix. Empty if there is no index yet.
+        #Run ids start with a timestamp, so for a key written by several runs the latest run wins.
+        index = {}
+        for index_key in sorted(self.listS3Keys(bucket_name, index_prefix)):
+            index_object = self._s3.meta.client.get_object(Bucket=bucket_name, Key=index_key)
+            index.update(json.loads(index_object['Body'].read().decode('utf-8'))['keys'])
+        return index
+
+
+    def writeS3KeyIndex(self, bucket_name, s3_basefolder, key_mapping):
+        #Writes key_mapping (logical key -> physical key) to this run's index object in each date folder. Index objects of
+        #earlier runs are left alone, so the index still finds their objects (even with a different s3_key_shards).
+        if self._s3_key_layout != 'hashed' or len(key_mapping) == 0:
+            return
+        #Backups and folder2folder copies of the same run may share a date folder, so this run's entries are kept in _s3_key_index_dict
+        index_keys = set()
+        for logical_key, physical_key in key_mapping.items():
+            index_key = self.getS3KeyIndexPrefix(s3_basefolder, logical_key) + self._s3_key_index_run_id + '.json'
+            self._s3_key_index_dict.setdefault((bucket_name, index_key), {})[logical_key] = physical_key
+            index_keys.add(index_key)
+        for index_key in sorted(index_keys):
+            index = self._s3_key_index_dict[(bucket_name, index_key)]
+            logging.info("Writing key index of %d keys to S3.. in Bucket: %s, Key: %s", len(index), bucket_name, index_key)
+            self._s3.Object(bucket_name, index_key).put(Body=json.dumps({'layout' : 'hashed', 'shards' : self._s3_key_shards, 'keys' : index}, separators=(',',':'), sort_keys=True).encode(), ContentType='application/json')
+
+
+    def findPhysicalS3Key(self, bucket_name, s3_basefolder, logical_key):
+        #For restores: returns the physical key of a backed up/copied object given its logical key (base/year/month/day/..).
+        #Looks in the key index of that date first and falls back to recomputing the shard. No listing of shards needed.
+        if self._s3_key_layout != 'hashed':
+            return logical_key
+        index = self.getS3KeyIndex(bucket_name, self.getS3KeyIndexPrefix(s3_basefolder, logical_key))
+        if logical_key in index:
+            return index[logical_key]
+        return self.getPhysicalS3Key(s3_basefolder, logical_key)
+
+
     def writeLocalFolderToS3Folder(self):
         #Copies the entire contents of a local folder to S3 folder by calling writeOneObjectToS3()
         #As of writing this, AWS API for folder-to-folder copy is only available in Java/C# and not in Python. Hence the custom logic below.
@@ -417,6 +575,7 @@ class dataInterface:
             self._folder2folder_source_folder = self._folder2folder_source_folder[:-1]        
         source_folder_without_path = self._folder2folder_source_folder.split(self._path_delim)[-1]
         data_month_bkp_folder = self._folder2folder_target_s3_basefolder + '/' + self._curr_year + '/' + self._curr_month + '/' + self._curr_day
+        key_mapping = {}
         if self._folder2folder_copy == True:
             for curr_path, subfolders, files_in_curr_path in os.walk(self._folder2folder_source_folder):
                 if len(files_in_curr_path) == 0:
@@ -425,31 +584,43 @@ class dataInterface:
                     for each_file in files_in_curr_path:
                         #The first replace() gets directory tree "under" source folder by erasing the tree above it. Second replace() makes sure we have S3 path delimiter (/)
                         curr_folder = source_folder_without_path + curr_path.replace(self._folder2folder_source_folder,'').replace(self._path_delim,'/')
-                        logging.info("Writing to S3.. in Bucket: %s, Key: %s, using input file: %s",self._s3_bucket_name, data_month_bkp_folder+'/'+curr_folder+'/'+each_file, curr_path+self._path_delim+each_file)
+                        #With s3_key_layout = hashed the object goes under a shard prefix. Filename has no /, so the folder is everything before the last /.
+                        logical_key = data_month_bkp_folder+'/'+curr_folder+'/'+each_file+self.getUploadExtension(curr_path+self._path_delim+each_file)
+                        physical_key = self.getPhysicalS3Key(self._folder2folder_target_s3_basefolder, logical_key)
+                        key_mapping[logical_key] = physical_key
+                        logging.info("Writing to S3.. in Bucket: %s, Key: %s, using input file: %s",self._s3_bucket_name, physical_key, curr_path+self._path_delim+each_file)
                         try:
-                            self.writeOneObjectToS3(data_month_bkp_folder+'/'+curr_folder, curr_path+self._path_delim+each_file)
+                            self.writeOneObjectToS3(physical_key.rsplit('/',1)[0], curr_path+self._path_delim+each_file)
                         except AttributeError as ae:
-                            logging.warning("Failed writing to S3.. in Bucket: %s, Key: %s, using input file: %s",self._s3_bucket_name, data_month_bkp_folder+'/'+curr_folder+'/'+each_file, curr_path+self._path_delim+each_file)
+                            logging.warning("Failed writing to S3.. in Bucket: %s, Key: %s, using input file: %s",self._s3_bucket_name, physical_key, curr_path+self._path_delim+each_file)
                             logging.warning(ae)
                             raise
+        self.writeS3KeyIndex(self._s3_bucket_name, self._folder2folder_target_s3_basefolder, key_mapping)
 
     def backupS3Objects(self):
         #Backup S3 objects to another S3 location, for example before they get overwritten.
         if self._s3_backup == False:
             logging.info("s3_backup = false. Won't back up data files into S3.")
             return
-        if self._s3_file_compress == True:
-            gzfile_extn = '.gz'
-        else:
-            gzfile_extn = ''
 
         data_month_bkp_folder = self._s3_backup_basefolder_name + '/' + self._curr_year + '/' + self._curr_month + '/' + self._curr_day
+        key_mapping = {}
         for name,folder_name in self._s3_folder_dict.items():
             folder_number = name.split('_')[3].strip()
             for varname, file_name in self._sql_output_file_dict.items():
                 file_number = varname.split('_')[4].strip()
                 if folder_number == file_number:
                     no_path_filename = self.stripFilenameFromPath(file_name)
+                    gzfile_extn = self.getUploadExtension(file_name)
+
+                    #Chunked output: back up the part files and manifest of the last run. The date is already in the target folder name.
+                    if self._output_chunking == True:
+                        for s3_source_key in self.listS3Keys(self._s3_bucket_name, self.getChunkS3Prefix(folder_name, file_name)) + self.listS3Keys(self._s3_bucket_name, folder_name + '/' + no_path_filename + '.manifest.json'):
+                            s3_target_key = self.getPhysicalS3Key(self._s3_backup_basefolder_name, data_month_bkp_folder + '/' + s3_source_key)
+                            key_mapping[data_month_bkp_folder + '/' + s3_source_key] = s3_target_key
+                            logging.info("Backing up S3 Key: %s in Bucket: %s to target S3 Key: %s in backup bucket: %s. Backed up key will be assigned Storage Class: %s",s3_source_key, self._s3_bucket_name, s3_target_key, self._s3_backup_bucket_name, self._s3_backup_storage_class)
+                            self._s3.meta.client.copy_object(Bucket=self._s3_backup_bucket_name, CopySource={'Bucket' : self._s3_bucket_name, 'Key' : s3_source_key}, Key=s3_target_key, StorageClass=self._s3_backup_storage_class)
+                        continue
 
                     #source:
                     s3_source_key = folder_name + '/' + no_path_filename + gzfile_extn
@@ -457,7 +628,8 @@ class dataInterface:
                                  'Key' : s3_source_key
                                 }
                     #target key:
-                    s3_target_key = data_month_bkp_folder + '/' + folder_name + '/' + no_path_filename.split('.')[0] + '.' + self._curr_year + '.' + self._curr_month + '.' + self._curr_day + '.' + no_path_filename.split('.')[-1] + gzfile_extn
+                    s3_logical_target_key = data_month_bkp_folder + '/' + folder_name + '/' + no_path_filename.split('.')[0] + '.' + self._curr_year + '.' + self._curr_month + '.' + self._curr_day + '.' + no_path_filename.split('.')[-1] + gzfile_extn
+                    s3_target_key = self.getPhysicalS3Key(self._s3_backup_basefolder_name, s3_logical_target_key)
                     
                     #copy object to target aka back up
                     #this is the only place a botocore client call is placed instead of resource call (primarily because:
@@ -471,11 +643,13 @@ class dataInterface:
                     if bucket_listing_dict.get('KeyCount') > 0:
                         logging.info("Backing up S3 Key: %s in Bucket: %s to target S3 Key: %s in backup bucket: %s. Backed up key will be assigned Storage Class: %s",s3_source['Key'], s3_source['Bucket'], s3_target_key, self._s3_backup_bucket_name, self._s3_backup_storage_class)
                         self._s3.meta.client.copy_object(Bucket=self._s3_backup_bucket_name, CopySource=s3_source, Key=s3_target_key, StorageClass=self._s3_backup_storage_class)
+                        key_mapping[s3_logical_target_key] = s3_target_key
+        self.writeS3KeyIndex(self._s3_backup_bucket_name, self._s3_backup_basefolder_name, key_mapping)
                     
 
     def backupLocalFiles(self):
         #Backup local data files to another location on that local server (usually Oracle server)
-        #Do not call this function before writing to S3 because compression is expected to have happened by now(check compression comments below)
+        #Call this after writing to S3. Data files are compressed here if needed, and the compressed copies are deleted after backup.
         if self._local_backup == False:
             logging.info("local_backup = false. Won't back up on local server.")
             return
@@ -489,11 +663,24 @@ class dataInterface:
             logging.warning("Local backup folder \"%s\" already exists or unable to create. Attempting to back up here..", data_month_bkp_folder)
         
         #Compress data files if they are not compressed already, then back up. It's usually already compressed by the time we get here.
+        local_data_files = []
         for varname, file_name in self._sql_output_file_dict.items():
+            if file_name in self._chunked_output_parts:
+                local_data_files.extend([part['file'] for part in self._chunked_output_parts[file_name]])
+            else:
+                local_data_files.append(file_name)
+        for file_name in local_data_files:
             filename_without_path = self.stripFilenameFromPath(file_name)
             try:
-                #Compress (compress only if below variable is set to false. The assumption is, when set to True compression already happened in writeOneObjectToS3())
-                if self._s3_file_compress == False:
+                if file_name in self._parquet_output_files:
+                    #Parquet is already compressed. Back up as is and keep the original.
+                    bkp_src = file_name
+                    bkp_tgt = data_month_bkp_folder + filename_without_path
+                    shutil.copyfile(bkp_src,bkp_tgt)
+                    logging.info("Local backup successful. Source: %s Target: %s", bkp_src, bkp_tgt)
+                    continue
+                #Compress, unless there's a compressed copy already. writeOneObjectToS3() deletes its compressed copy after loading it to S3.
+                if not os.path.isfile(file_name + ".gz"):
                     self.gzCompressFile(file_name)
                 #Back up
                 bkp_src = file_name + ".gz"
@@ -567,75 +754,387 @@ class dataInterface:
         return final_full_sql
         
         
+    def arrowTypeForNumber(self, precision, scale):
+        #Oracle NUMBER is exact, so by default it's never written as float64 (wide integer IDs don't fit, money columns lose exactness).
+        #NUMBER(p<=18,0) is int64, NUMBER(p,s>=0) is decimal128(p,s). Unconstrained NUMBER (also COUNT/SUM etc., reported as precision 0
+        #and scale -127), FLOAT and negative scales have no fixed precision/scale. They're written as set by parquet_unconstrained_number.
+        if precision is not None and scale is not None and 0 < precision <= 38 and scale >= 0:
+            if scale == 0 and precision <= 18:
+                return pa.int64()
+            return pa.decimal128(max(precision, scale), scale)
+        if self._parquet_unconstrained_number == 'double':
+            return pa.float64()
+        if self._parquet_unconstrained_number == 'string':
+            return pa.string()
+        return pa.decimal128(self._parquet_unconstrained_decimal[0], self._parquet_unconstrained_decimal[1])
+
+
+    def parquetOutputTypeHandler(self, cursor, name, default_type, size, precision, scale):
+        #cx_Oracle outputtypehandler, set on the cursor by extractOracleToFile() when outputfile_format = parquet.
+        #By default cx_Oracle returns NUMBER as int or float. Fetch the columns so that values match the types picked by arrowTypeForNumber().
+        if default_type != cxoracle.NUMBER:
+            return None
+        arrow_type = self.arrowTypeForNumber(precision, scale)
+        if pa.types.is_decimal(arrow_type):
+            #Unconstrained NUMBER can have more decimals than parquet_unconstrained_number's scale, so values are rounded (half even) to
+            #the column's scale. A value with more integer digits than precision - scale fails the extract instead of being cut.
+            exponent = decimal.Decimal(1).scaleb(-arrow_type.scale)
+            context = decimal.Context(prec=arrow_type.precision, traps=[decimal.InvalidOperation])
+            return cursor.var(decimal.Decimal, arraysize=cursor.arraysize, outconverter=lambda value: value.quantize(exponent, context=context))
+        if pa.types.is_floating(arrow_type):
+            return cursor.var(float, arraysize=cursor.arraysize)
+        if pa.types.is_string(arrow_type):
+            #Fetched as Decimal and formatted here. A str fetch would follow the session's NLS_NUMERIC_CHARACTERS (Eg: "3,14").
+            return cursor.var(decimal.Decimal, arraysize=cursor.arraysize, outconverter=lambda value: format(value, 'f'))
+        return None
+
+
+    def arrowTypeFromCursor(self, column_desc, column_values):
+        #This method is called from writeCursorToParquet()
+        #Map a cx_Oracle column type (cursor.description) to an Arrow type. Type names differ between cx_Oracle
+        #versions (NUMBER vs DB_TYPE_NUMBER) so match on the name. If the driver doesn't tell, infer from the first batch.
+        type_name = str(column_desc[1]).upper()
+        precision = column_desc[4]
+        scale = column_desc[5]
+        if 'NUMBER' in type_name:
+            arrow_type = self.arrowTypeForNumber(precision, scale)
+            if not (precision is not None and scale is not None and 0 < precision <= 38 and scale >= 0):
+                logging.info("Column %s is NUMBER without fixed precision and scale (or FLOAT). Writing it to Parquet as %s (parquet_unconstrained_number = %s).", column_desc[0], arrow_type, self._parquet_unconstrained_number)
+            return arrow_type
+        if 'FLOAT' in type_name or 'DOUBLE' in type_name:
+            return pa.float64()
+        if 'DATE' in type_name or 'TIMESTAMP' in type_name:
+            return pa.timestamp('us')
+        if 'CHAR' in type_name or 'STRING' in type_name or 'CLOB' in type_name:
+            return pa.string()
+        if 'RAW' in type_name or 'BLOB' in type_name or 'BINARY' in type_name:
+            return pa.binary()
+        inferred_type = pa.array(column_values).type
+        #A column that is all nulls in the first batch could be anything. String is the safest bet.
+        if pa.types.is_null(inferred_type):
+            return pa.string()
+        return inferred_type
+
+
+    def writeCursorToParquet(self, cursor, filename, s3_folder=None):
+        #This method is called from extractOracleToFile() when outputfile_format = parquet
+        #Fetches parquet_row_group_size rows at a time and writes each fetch as one row group,
+        #so only one row group is held in memory no matter how big the resultset is.
+        #With chunked output, rolls to a new part file (checked after each row group) and uploads finished parts.
+        lob_columns = [i for i, column_desc in enumerate(cursor.description) if 'LOB' in str(column_desc[1]).upper()]
+        fetch_size = self._parquet_row_group_size
+        if self._output_chunking == True and self._chunk_rows > 0:
+            fetch_size = min(fetch_size, self._chunk_rows)
+        def fetchColumns():
+            #Row batch to column lists. LOBs are fetched as locators, read them into str/bytes.
+            rows = cursor.fetchmany(fetch_size)
+            if len(rows) == 0:
+                return []
+            columns = [list(values) for values in zip(*rows)]
+            for i in lob_columns:
+                columns[i] = [None if value is None else value.read() for value in columns[i]]
+            return columns
+
+        columns = fetchColumns()
+        if len(columns) == 0:
+            first_batch = [[] for column_desc in cursor.description]
+        else:
+            first_batch = columns
+        schema = pa.schema([pa.field(column_desc[0], self.arrowTypeFromCursor(column_desc, column_values)) for column_desc, column_values in zip(cursor.description, first_batch)])
+        compression = {}
+        for column_name in schema.names:
+            compression[column_name] = self._parquet_column_codecs.get(column_name.upper(), self._parquet_default_codec)
+        if self._output_chunking == False:
+            with pq.ParquetWriter(filename, schema, compression=compression) as writer:
+                while len(columns) > 0:
+                    batch = pa.RecordBatch.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema)
+                    writer.write_batch(batch, row_group_size=self._parquet_row_group_size)
+                    columns = fetchColumns()
+            return
+
+        self.startChunkedOutput(filename, s3_folder)
+        while True:
+            part_file_name = self.nextChunkFileName(filename)
+            self._parquet_output_files.add(part_file_name)
+            part_rows = 0
+            with pq.ParquetWriter(part_file_name, schema, compression=compression) as writer:
+                while len(columns) > 0:
+                    batch = pa.RecordBatch.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema)
+                    writer.write_batch(batch, row_group_size=self._parquet_row_group_size)
+                    part_rows += batch.num_rows
+                    columns = fetchColumns()
+                    if self.chunkIsFull(part_rows, os.path.getsize(part_file_name)):
+                        break
+            self.completeChunk(filename, s3_folder, part_file_name, part_rows)
+            if len(columns) == 0:
+                break
+        self.finishChunkedOutput(filename, s3_folder)
+
+
+    def startChunkedOutput(self, filename, s3_folder):
+        #This method is called before extracting into part files of filename.
+        #Parts are loaded to S3 while extraction continues, so connectToS3() must have been called already.
+        try:
+            assert s3_folder is None or self._s3 is not None, "Terminating. outputfile_chunk_rows/outputfile_chunk_mb is set, so parts are loaded to S3 during extraction. Call connectToS3() before extractOracleToFile()."
+        except AssertionError as ae:
+            logging.warning(ae.args[0])
+            raise
+        self._chunked_output_parts[filename] = []
+        if s3_folder is not None:
+            #Parts of this run overwrite the earlier run's parts in place. Delete the earlier manifest first, so that readers never follow
+            #it to a mix of old and new parts. The manifest is written again by finishChunkedOutput() once every part is loaded.
+            manifest_key = s3_folder + '/' + self.stripFilenameFromPath(filename) + '.manifest.json'
+            logging.info("Deleting manifest of the earlier run in S3.. in Bucket: %s, Key: %s", self._s3_bucket_name, manifest_key)
+            self._s3.Object(self._s3_bucket_name, manifest_key).delete()
+        if self._chunk_uploader is None:
+            #A single uploader thread is enough to overlap upload with extraction, and the boto3 resource is never used by two threads at once.
+            self._chunk_uploader = ThreadPoolExecutor(max_workers=1)
+
+
+    def getChunkFileName(self, filename, part_number):
+        #Part files are named <file>.partNNNNN. The S3 key becomes <file>.partNNNNN.gz when compressed.
+        #Parquet parts keep the .parquet extension at the end (<name>.partNNNNN.parquet) for Athena/Spark.
+        if filename in self._parquet_output_files:
+            file_root, file_extn = os.path.splitext(filename)
+            return file_root + '.part' + str(part_number).zfill(5) + file_extn
+        return filename + '.part' + str(part_number).zfill(5)
+
+
+    def getChunkFilePattern(self, filename):
+        #glob pattern matching all part files of filename (see getChunkFileName())
+        part_file_name = self.getChunkFileName(filename, 0)
+        part_position = part_file_name.rfind('.part00000')
+        return glob.escape(part_file_name[:part_position]) + '.part' + '[0-9]'*5 + glob.escape(part_file_name[part_position+len('.part00000'):])
+
+
+    def getChunkS3Prefix(self, s3_folder, filename):
+        #S3 prefix shared by all part objects of filename in s3_folder
+        part_file_name = self.stripFilenameFromPath(self.getChunkFileName(filename, 0))
+        return s3_folder + '/' + part_file_name[:part_file_name.rfind('.part00000')] + '.part'
+
+
+    def nextChunkFileName(self, filename):
+        return self.getChunkFileName(filename, len(self._chunked_output_parts[filename]) + 1)
+
+
+    def chunkIsFull(self, part_rows, part_bytes):
+        #True when the part file being written reached outputfile_chunk_rows or outputfile_chunk_mb
+        if self._chunk_rows > 0 and part_rows >= self._chunk_rows:
+            return True
+        if self._chunk_bytes > 0 and part_bytes >= self._chunk_bytes:
+            return True
+        return False
+
+
+    def completeChunk(self, filename, s3_folder, part_file_name, part_rows):
+        #Records a finished part file and hands it to the uploader thread. The upload goes through writeOneObjectToS3(),
+        #so compression and multipart upload work as for any other file.
+        #Uploads of earlier parts that already finished are checked here, so a failed upload stops extraction right away.
+        for earlier_part in self._chunked_output_parts[filename]:
+            if earlier_part['upload'] is not None and earlier_part['upload'].done():
+                #result() re-raises the exception if the upload failed
+                earlier_part['upload'].result()
+        part = {'file' : part_file_name, 'rows' : part_rows, 'uncompressed_bytes' : os.path.getsize(part_file_name), 'upload' : None}
+        logging.info("Part file %s complete with %d rows.", part_file_name, part_rows)
+        if s3_folder is not None:
+            part['upload'] = self._chunk_uploader.submit(self.writeOneObjectToS3, s3_folder, part_file_name)
+        self._chunked_output_parts[filename].append(part)
+
+
+    def finishChunkedOutput(self, filename, s3_folder):
+        #Waits for the uploads of all parts of filename, then writes the manifest object (<file>.manifest.json) listing
+        #the parts with their row counts, and deletes parts left in S3 by an earlier run that had more parts.
+        parts = self._chunked_output_parts[filename]
+        for part in parts:
+            if part['upload'] is not None:
+                #result() re-raises the exception if the upload failed. It returns the size of the loaded (compressed) object.
+                part['bytes'] = part['upload'].result()
+        if s3_folder is None:
+            return
+        no_path_filename = self.stripFilenameFromPath(filename)
+        manifest = {'file' : no_path_filename,
+                    'format' : self._outputfile_format,
+                    'total_rows' : sum([part['rows'] for part in parts]),
+                    'parts' : []
+                   }
+        for part in parts:
+            manifest['parts'].append({'key' : s3_folder + '/' + self.stripFilenameFromPath(part['file']) + self.getUploadExtension(part['file']),
+                                      'rows' : part['rows'],
+                                      'bytes' : part['bytes'],
+                                      'uncompressed_bytes' : part['uncompressed_bytes']
+                                     })
+        manifest_key = s3_folder + '/' + no_path_filename + '.manifest.json'
+        logging.info("Writing manifest of %d parts to S3.. in Bucket: %s, Key: %s", len(parts), self._s3_bucket_name, manifest_key)
+        self._s3.Object(self._s3_bucket_name, manifest_key).put(Body=json.dumps(manifest, indent=1).encode(), ContentType='application/json', StorageClass=self._s3_storage_class)
+
+        current_keys = [part['key'] for part in manifest['parts']]
+        for s3_key in self.listS3Keys(self._s3_bucket_name, self.getChunkS3Prefix(s3_folder, filename)):
+            if s3_key not in current_keys:
+                logging.info("Deleting S3 Key: %s in Bucket: %s. It's a part left over from an earlier run.", s3_key, self._s3_bucket_name)
+                self._s3.Object(self._s3_bucket_name, s3_key).delete()
+
+
+    def writeRowsToChunks(self, rows, filename, s3_folder, openPart):
+        #Writes rows into part files of filename, rolling to a new part at outputfile_chunk_rows rows or outputfile_chunk_mb MB.
+        #openPart(part_file_name) opens a part file (writing the header if needed) and returns the file and a function that writes one row.
+        #An empty resultset still produces one part, so that the manifest is never empty.
+        self.startChunkedOutput(filename, s3_folder)
+        part_file = None
+        for row in rows:
+            if part_file is None:
+                part_file_name = self.nextChunkFileName(filename)
+                part_file, writeRow = openPart(part_file_name)
+                part_rows = 0
+            writeRow(row)
+            part_rows += 1
+            #tell() isn't free, so file size is only checked every 1000 rows
+            if self.chunkIsFull(part_rows, part_file.tell() if part_rows % 1000 == 0 else 0):
+                part_file.close()
+                self.completeChunk(filename, s3_folder, part_file_name, part_rows)
+                part_file = None
+        if part_file is None and len(self._chunked_output_parts[filename]) == 0:
+            part_file_name = self.nextChunkFileName(filename)
+            part_file, writeRow = openPart(part_file_name)
+            part_rows = 0
+        if part_file is not None:
+            part_file.close()
+            self.completeChunk(filename, s3_folder, part_file_name, part_rows)
+        self.finishChunkedOutput(filename, s3_folder)
+
+        
     def extractOracleToFile(self):
         #Run SQLs in diConfig.ini and write resultset to output file (mentioned in diConfig.ini)
         #But if data files are already spooled don't bother
         if self._oracle_spooling == True:
             return
-        if self._oracle_sqlplus_connection == True:
+        try:
+            if self._oracle_sqlplus_connection == True:
             
-            #Extract data via SQLPlus            
-            for name, sql_stmt in self._sql_stmts_dict.items():
-                #For each SQL statement, get the corresponding _N output file. (That is, for sql_stmt_number_1 get outputfile_of_sql_stmt_number_1, and so on..)
-                stmt_number = name.split('_')[2].strip()
-                formatted_SQL = self.formatSQLforSQLPlus(sql_stmt)
-                for varname, filename in self._sql_output_file_dict.items():
-                    outputfile_number = varname.split('_')[4].strip()
-                    if  outputfile_number == stmt_number:
-                        logging.info("oracle_sqlplus_connection = true. Connecting to Oracle via SQLPlus. cx_Oracle pkg won't be used.")
-                        try:
-                            #Call Popen() to create a connection process for each sql_stmt. Calling this just once in ConnectToOracleDB() for all SQLs was messy.
-                            self._oracle = Popen(['sqlplus', '-S', self._oracle_user_name+'/'+self._oracle_password_token+'@'+self._oracle_service_name], stdin=PIPE, stdout=PIPE, stderr=PIPE, universal_newlines=True)
-                            self._oracle.stdin.write(formatted_SQL)
-                            stdout, stderr = self._oracle.communicate()
-                            with open(filename, 'w') as output_file: 
-                                line = ""
-                                current_line_is_header = True
-                                #Write header
-                                if self._file_fmt_header == True:
-                                    output_file.write(self._column_names+"\n")
-                                #for char in stdout.decode("utf-8","ignore"):  #this is commented out, but may be needed in Python 3! (maybe not - tested ok in Python 3)
-                                for char in stdout:
-                                    line+=char
-                                    if char == '\n':
-                                        output_file.write(line)
-                                        line = ""
-                            logging.info("Successfully wrote Oracle data to %s", filename)
-                            break
+                #Extract data via SQLPlus            
+                for name, sql_stmt in self._sql_stmts_dict.items():
+                    #For each SQL statement, get the corresponding _N output file. (That is, for sql_stmt_number_1 get outputfile_of_sql_stmt_number_1, and so on..)
+                    stmt_number = name.split('_')[2].strip()
+                    formatted_SQL = self.formatSQLforSQLPlus(sql_stmt)
+                    for varname, filename in self._sql_output_file_dict.items():
+                        outputfile_number = varname.split('_')[4].strip()
+                        if  outputfile_number == stmt_number:
+                            logging.info("oracle_sqlplus_connection = true. Connecting to Oracle via SQLPlus. cx_Oracle pkg won't be used.")
+                            try:
+                                #Call Popen() to create a connection process for each sql_stmt. Calling this just once in ConnectToOracleDB() for all SQLs was messy.
+                                stderr = ''
+                                stderr_target = PIPE
+                                if self._output_chunking == True:
+                                    #stdout is read while sqlplus runs (below), so stderr goes to a temp file. A stderr pipe that nobody reads
+                                    #until sqlplus exits would block sqlplus once it's full, and this process with it.
+                                    stderr_target = tempfile.TemporaryFile(mode='w+')
+                                self._oracle = Popen(['sqlplus', '-S', self._oracle_user_name+'/'+self._oracle_password_token+'@'+self._oracle_service_name], stdin=PIPE, stdout=PIPE, stderr=stderr_target, universal_newlines=True)
+                                self._oracle.stdin.write(formatted_SQL)
+                                if self._output_chunking == True:
+                                    #Stream rows as sqlplus prints them, instead of communicate() which holds the whole resultset in memory.
+                                    #That way parts are written and loaded to S3 while the query is still running.
+                                    self._oracle.stdin.close()
+                                    def openPart(part_file_name):
+                                        part_file = open(part_file_name, 'w')
+                                        if self._file_fmt_header == True:
+                                            part_file.write(self._column_names+"\n")
+                                        return part_file, part_file.write
+                                    def readStderr():
+                                        stderr_target.seek(0)
+                                        return stderr_target.read()
+                                    def sqlplusLines():
+                                        #Same as below, a trailing line without a line break is not written
+                                        for line in self._oracle.stdout:
+                                            if line[-1:] == '\n':
+                                                yield line
+                                        #Fail before the manifest is written, so a failed sqlplus run doesn't look complete in S3
+                                        if self._oracle.wait() != 0:
+                                            raise OSError("sqlplus exited with return code %d: %s" % (self._oracle.returncode, readStderr()))
+                                    try:
+                                        self.writeRowsToChunks(sqlplusLines(), filename, self._s3_folder_dict.get('s3_folder_name_' + stmt_number), openPart)
+                                        stderr = readStderr()
+                                    finally:
+                                        stderr_target.close()
+                                        #If writing the parts failed, sqlplus is still running (blocked on a full stdout pipe). Stop it.
+                                        if self._oracle.poll() is None:
+                                            self._oracle.kill()
+                                            self._oracle.wait()
+                                    logging.info("Successfully wrote Oracle data to %d part files of %s", len(self._chunked_output_parts[filename]), filename)
+                                    break
+                                stdout, stderr = self._oracle.communicate()
+                                with open(filename, 'w') as output_file: 
+                                    line = ""
+                                    current_line_is_header = True
+                                    #Write header
+                                    if self._file_fmt_header == True:
+                                        output_file.write(self._column_names+"\n")
+                                    #for char in stdout.decode("utf-8","ignore"):  #this is commented out, but may be needed in Python 3! (maybe not - tested ok in Python 3)
+                                    for char in stdout:
+                                        line+=char
+                                        if char == '\n':
+                                            output_file.write(line)
+                                            line = ""
+                                logging.info("Successfully wrote Oracle data to %s", filename)
+                                break
                         
-                        except (OSError, ValueError) as ora_err:
-                            logging.warning("Failed to query Oracle or write to %s", filename)
-                            logging.warning(ora_err)
-                            logging.warning(stderr)
-                            raise
-                            sys.exit(1)
+                            except (OSError, ValueError) as ora_err:
+                                logging.warning("Failed to query Oracle or write to %s", filename)
+                                logging.warning(ora_err)
+                                logging.warning(stderr)
+                                raise
+                                sys.exit(1)
                             
-        else:
-            #Extract data via cx_Oracle and InstantClient           
-            for name, sql_stmt in self._sql_stmts_dict.items():
-                #For each SQL statement, get the corresponding _N output file. (That is, for sql_stmt_number_1 get outputfile_of_sql_stmt_number_1, and so on..)
-                stmt_number = name.split('_')[2].strip()
-                for varname, filename in self._sql_output_file_dict.items():
-                    outputfile_number = varname.split('_')[4].strip()
-                    if  outputfile_number == stmt_number:
-                        try:
-                            cursor = self._oracle.cursor()
-                            cursor.execute(sql_stmt)
-                            file = open(filename,'w',newline='') #rewrite this using "with"
-                            csvout = csv.writer(file, delimiter=self._file_fmt_delim, quoting=eval('csv.'+self._file_fmt_quote), escapechar=self._file_fmt_escape)
-                            #Write header
-                            if self._file_fmt_header == True:
-                                column_names = [item[0] for item in cursor.description]
-                                csvout.writerow(column_names)
-                            csvout.writerows(cursor)
-                            file.close()
-                            logging.info("Successfully wrote Oracle data to %s", filename)
-                            break
-                        except OSError as ose:
-                            logging.warning("Failed to query Oracle or write to %s", filename)
-                            logging.warning(ose)
-                            raise
-                            sys.exit(1)
-            self._oracle.close()
+            else:
+                #Extract data via cx_Oracle and InstantClient           
+                for name, sql_stmt in self._sql_stmts_dict.items():
+                    #For each SQL statement, get the corresponding _N output file. (That is, for sql_stmt_number_1 get outputfile_of_sql_stmt_number_1, and so on..)
+                    stmt_number = name.split('_')[2].strip()
+                    for varname, filename in self._sql_output_file_dict.items():
+                        outputfile_number = varname.split('_')[4].strip()
+                        if  outputfile_number == stmt_number:
+                            try:
+                                cursor = self._oracle.cursor()
+                                if self._outputfile_format == 'parquet':
+                                    cursor.outputtypehandler = self.parquetOutputTypeHandler
+                                cursor.execute(sql_stmt)
+                                if self._outputfile_format == 'parquet':
+                                    self.writeCursorToParquet(cursor, filename, self._s3_folder_dict.get('s3_folder_name_' + stmt_number))
+                                    logging.info("Successfully wrote Oracle data to %s", filename)
+                                    break
+                                if self._output_chunking == True:
+                                    column_names = [item[0] for item in cursor.description]
+                                    def openPart(part_file_name):
+                                        part_file = open(part_file_name,'w',newline='')
+                                        csvout = csv.writer(part_file, delimiter=self._file_fmt_delim, quoting=eval('csv.'+self._file_fmt_quote), escapechar=self._file_fmt_escape)
+                                        if self._file_fmt_header == True:
+                                            csvout.writerow(column_names)
+                                        return part_file, csvout.writerow
+                                    self.writeRowsToChunks(cursor, filename, self._s3_folder_dict.get('s3_folder_name_' + stmt_number), openPart)
+                                    logging.info("Successfully wrote Oracle data to %d part files of %s", len(self._chunked_output_parts[filename]), filename)
+                                    break
+                                file = open(filename,'w',newline='') #rewrite this using "with"
+                                csvout = csv.writer(file, delimiter=self._file_fmt_delim, quoting=eval('csv.'+self._file_fmt_quote), escapechar=self._file_fmt_escape)
+                                #Write header
+                                if self._file_fmt_header == True:
+                                    column_names = [item[0] for item in cursor.description]
+                                    csvout.writerow(column_names)
+                                csvout.writerows(cursor)
+                                file.close()
+                                logging.info("Successfully wrote Oracle data to %s", filename)
+                                break
+                            except (OSError, ValueError) as ose:
+                                logging.warning("Failed to query Oracle or write to %s", filename)
+                                logging.warning(ose)
+                                raise
+                                sys.exit(1)
+                self._oracle.close()
+        finally:
+            if self._chunk_uploader is not None:
+                #If extraction failed, part uploads that haven't started are cancelled. Either way the uploader thread is stopped.
+                for parts in self._chunked_output_parts.values():
+                    for part in parts:
+                        if part['upload'] is not None:
+                            part['upload'].cancel()
+                self._chunk_uploader.shutdown()
+                self._chunk_uploader = None
 
 
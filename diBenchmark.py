@@ -0,0 +1,770 @@
+################################################################################
+#COMMENTS
+
+#General:
+
+#Benchmark harness for dataInterface. Runs the same sequence of dataInterface
+#method calls as diCaller.py, but against local stand-ins so that it can be run
+#on any machine without AWS or Oracle, and times every stage separately.
+#This script should be on the same path as dataInterface.py and diConfig.ini.
+
+#Stand-ins:
+
+# - S3: moto's in-process S3 mock. Buckets are created (and pre-seeded so that
+#   backupS3Objects() has something to copy) before the stages run.
+# - cx_Oracle: a fake cx_Oracle module whose connect() returns a sqlite3
+#   connection to a pre-populated table (bench_data) with NUMBER(p,0), NUMBER,
+#   DATE, CLOB, NUMBER(p,s) and VARCHAR2 columns. The cursor reports Oracle types,
+#   precision and scale in its description, returns cx_Oracle's Python types
+#   (LOB locators for CLOB) and calls the cursor's outputtypehandler, so the
+#   Parquet type mapping runs as it would against Oracle.
+# - sqlplus: a fake sqlplus executable put first on PATH. It reads the SQL that
+#   formatSQLforSQLPlus() generates and prints the rows of bench_data tilde(~) separated.
+
+#How it works:
+
+#Each case (one combination of connection type, rows, file count and row width)
+#runs in a fresh child process with its own work directory holding a copy of
+#dataInterface.py and a generated diConfig.ini. The [DEFAULT] section of the real
+#diConfig.ini is reused, so new config variables are picked up automatically.
+#For every stage the child records latency, throughput and peak RSS (high-water
+#mark of the child process during the stage: VmHWM is reset through
+#/proc/self/clear_refs before the stage and read from /proc/self/status after it.
+#Linux only, peak RSS is left out on other platforms).
+#After the stages the child checks the results: the extracted row counts (and
+#Parquet column types), the local backup files, and that the data, backup and
+#folder2folder objects exist in the mocked buckets. A case whose checks fail is
+#reported as failed instead of producing timings.
+#Results are compared with a stored baseline (diBenchmark.baseline.json) and
+#regressions beyond --tolerance are flagged. Exit code is 1 if any are found.
+
+#Usage:
+
+#python diBenchmark.py                          (run default cases, compare with baseline)
+#python diBenchmark.py --save-baseline          (run default cases, store results as baseline)
+#python diBenchmark.py --rows 50000 --files 2 --columns 16 --connection sqlplus
+#python diBenchmark.py --output-format delimited parquet --connection cx_oracle
+#python diBenchmark.py --output-format parquet --unconstrained-number "decimal(38,10)" double string
+#python diBenchmark.py --chunk-rows 0 20000   (compare one file per SQL with 20000 row parts uploaded during extraction)
+#python diBenchmark.py --key-layout date hashed --f2f-files 500
+
+#Python:
+
+#Python 3 only. Needs boto3, moto, cryptography on top of what dataInterface needs
+#(cx_Oracle is not needed, it's faked). Not supported on AIX.
+#pip install moto
+
+#Author: Raj Samuel
+################################################################################
+
+import argparse
+import configparser
+import datetime
+import decimal
+import glob
+import gzip
+import itertools
+import json
+import os
+import platform
+import re
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+BENCH_SECTION = 'BENCHMARK'
+DATA_BUCKET = 'di-bench-data'
+BACKUP_BUCKET = 'di-bench-backup'
+REGION = 'us-east-2'
+DEFAULT_UNCONSTRAINED_NUMBER = 'decimal(38,10)'
+DEFAULT_BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'diBenchmark.baseline.json')
+
+#Fake sqlplus. {python} is replaced with the current interpreter. Prints the rows of the cx_Oracle stand-in's
+#table (see prepareWorkdir()), so both connection types extract the same data.
+FAKE_SQLPLUS = '''#!{python}
+import os
+import sqlite3
+import sys
+
+sql = sys.stdin.read()
+select_clause = sql.split(' FROM')[0]
+columns = select_clause.count("'~'") + 1
+out = sys.stdout
+for row in sqlite3.connect(os.environ['DI_BENCH_DB']).execute('SELECT * FROM bench_data'):
+    out.write('~'.join(['' if value is None else str(value) for value in row[:columns]]) + '\\n')
+'''
+
+#Oracle column types of bench_data, by column position. Columns after these are VARCHAR2(col_width).
+#They cover the cx_Oracle types dataInterface maps to Parquet types: NUMBER(p,0), unconstrained NUMBER, DATE, CLOB and NUMBER(p,s).
+ORACLE_COLUMN_TYPES = ['NUMBER(18,0)', 'NUMBER', 'DATE', 'CLOB', 'NUMBER(12,2)']
+
+
+def oracleColumnTypes(columns, col_width):
+    return (ORACLE_COLUMN_TYPES + ['VARCHAR2(%d)' % col_width] * columns)[:columns]
+
+
+def makeRow(n, columns, col_width):
+    #One synthetic row: an integer id, a number without fixed scale, a date, a CLOB (null every 10th row), an amount,
+    #then fixed width text columns. Same order as ORACLE_COLUMN_TYPES.
+    row = [n,
+           n / 7.0,
+           (datetime.datetime(2000, 1, 1) + datetime.timedelta(days=n % 10000)).strftime('%Y-%m-%d %H:%M:%S'),
+           None if n % 10 == 0 else ('%0*d' % (col_width, n * 3))[:col_width] * 4,
+           round(n * 1.25 % 1000000, 2)]
+    for c in range(5, columns):
+        row.append(('%0*d' % (col_width, n * c))[:col_width])
+    return row[:columns]
+
+
+def columnNames(columns):
+    return ['c' + str(c + 1) for c in range(columns)]
+
+
+def readProcStatusKb(names):
+    #Values (in kB) of the given fields of /proc/self/status, read in one go so they are consistent. None where there is no /proc (non Linux).
+    try:
+        with open('/proc/self/status') as status_file:
+            status = dict(line.split(':', 1) for line in status_file if ':' in line)
+        return [int(status[name].split()[0]) for name in names]
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+
+def resetPeakRss():
+    #Resets this process' RSS high-water mark (VmHWM) to its current RSS, so that the next peakRssKb() is the peak of one stage only.
+    #Needs Linux 4.0+. Returns False where the reset isn't available or had no effect, in which case peak RSS isn't recorded.
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except (IOError, OSError):
+        return False
+    values = readProcStatusKb(['VmHWM', 'VmRSS'])
+    return values is not None and values[0] <= values[1]
+
+
+def peakRssKb():
+    #RSS high-water mark of this process since the last resetPeakRss()
+    values = readProcStatusKb(['VmHWM'])
+    return values[0] if values is not None else None
+
+
+def totalFileBytes(filenames):
+    total = 0
+    for filename in filenames:
+        if os.path.isfile(filename):
+            total += os.path.getsize(filename)
+    return total
+
+
+def folderBytes(folder):
+    total = 0
+    for curr_path, subfolders, files_in_curr_path in os.walk(folder):
+        total += totalFileBytes([os.path.join(curr_path, f) for f in files_in_curr_path])
+    return total
+
+
+def mockAws():
+    #moto >= 5 has a single mock_aws(). Older versions have per service mocks.
+    try:
+        from moto import mock_aws
+    except ImportError:
+        from moto import mock_s3 as mock_aws
+    return mock_aws()
+
+
+class FakeDbType(object):
+    #Stand-in for cx_Oracle's DbType objects. dataInterface matches on the type name in str(type).
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return '<cx_Oracle.DbType DB_TYPE_' + self.name + '>'
+
+
+FAKE_DB_TYPES = dict((name, FakeDbType(name)) for name in ['NUMBER', 'DATE', 'CLOB', 'VARCHAR'])
+
+
+class FakeLob(object):
+    #cx_Oracle fetches LOB columns as locators. str() and read() return the value.
+    def __init__(self, value):
+        self._value = value
+
+    def read(self):
+        return self._value
+
+    def __str__(self):
+        return self._value
+
+
+class FakeVar(object):
+    #What cursor.var() returns. Fetched values are converted to its type, then passed through outconverter.
+    def __init__(self, var_type, outconverter=None):
+        self._var_type = var_type
+        self._outconverter = outconverter
+
+    def convert(self, value):
+        if self._var_type == decimal.Decimal:
+            value = decimal.Decimal(repr(value))
+        else:
+            value = self._var_type(value)
+        if self._outconverter is not None:
+            value = self._outconverter(value)
+        return value
+
+
+class FakeCursor(sqlite3.Cursor):
+    #sqlite3 cursor that behaves like a cx_Oracle one: description has Oracle types, precision and scale (from the declared
+    #column types of bench_data), fetched values have cx_Oracle's default Python types, and outputtypehandler is called at
+    #execute() time like cx_Oracle does, with cursor.var() deciding how the column is fetched.
+    outputtypehandler = None
+
+    @property
+    def description(self):
+        sqlite_description = super().description
+        if sqlite_description is None:
+            return None
+        description = []
+        for column in sqlite_description:
+            declared_type = re.match(r'(\w+)(?:\((\d+)(?:,(-?\d+))?\))?', self.connection.column_types[column[0]])
+            type_name, size, scale = declared_type.group(1), declared_type.group(2), declared_type.group(3)
+            if type_name == 'NUMBER':
+                #Oracle reports unconstrained NUMBER as precision 0, scale -127
+                description.append((column[0], FAKE_DB_TYPES['NUMBER'], 127, 22, int(size) if size else 0, int(scale) if scale else (0 if size else -127), True))
+            elif type_name == 'VARCHAR2':
+                description.append((column[0], FAKE_DB_TYPES['VARCHAR'], int(size), int(size), None, None, True))
+            else:
+                description.append((column[0], FAKE_DB_TYPES[type_name], None, None, None, None, True))
+        return description
+
+    def var(self, var_type, size=0, arraysize=None, outconverter=None):
+        return FakeVar(var_type, outconverter)
+
+    def columnConverter(self, column_desc):
+        name, db_type, size, internal_size, precision, scale, null_ok = column_desc
+        if self.outputtypehandler is not None:
+            var = self.outputtypehandler(self, name, db_type, size, precision, scale)
+            if var is not None:
+                return var.convert
+        if db_type.name == 'NUMBER':
+            #cx_Oracle default: int when the column has no decimals, otherwise int or float depending on the value
+            return int if scale == 0 else (lambda value: value)
+        if db_type.name == 'DATE':
+            return lambda value: datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+        if db_type.name == 'CLOB':
+            return FakeLob
+        return str
+
+    def execute(self, sql, *args):
+        super().execute(sql, *args)
+        self._converters = [self.columnConverter(column_desc) for column_desc in self.description]
+        return self
+
+    def convertRow(self, row):
+        return tuple([None if value is None else converter(value) for value, converter in zip(row, self._converters)])
+
+    def fetchmany(self, size=None):
+        return [self.convertRow(row) for row in super().fetchmany(self.arraysize if size is None else size)]
+
+    def fetchall(self):
+        return [self.convertRow(row) for row in super().fetchall()]
+
+    def fetchone(self):
+        row = super().fetchone()
+        return None if row is None else self.convertRow(row)
+
+    def __next__(self):
+        return self.convertRow(super().__next__())
+
+
+class FakeConnection(sqlite3.Connection):
+    def cursor(self, factory=FakeCursor):
+        cursor = super().cursor(factory)
+        if not hasattr(self, 'column_types'):
+            self.column_types = dict((column[1], column[2]) for column in super().execute('PRAGMA table_info(bench_data)'))
+        return cursor
+
+
+def installFakeCxOracle(db_file):
+    #Register a fake cx_Oracle module before dataInterface imports it.
+    fake = types.ModuleType('cx_Oracle')
+    def connect(*args, **kwargs):
+        return sqlite3.connect(db_file, factory=FakeConnection)
+    fake.connect = connect
+    for name, db_type in FAKE_DB_TYPES.items():
+        setattr(fake, 'DB_TYPE_' + name, db_type)
+    fake.NUMBER = FAKE_DB_TYPES['NUMBER']
+    sys.modules['cx_Oracle'] = fake
+
+
+def prepareWorkdir(case, workdir):
+    #Everything that isn't being measured is done here, in the parent process.
+    from cryptography.fernet import Fernet
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    for sub in ['data', 'logs', 'backup', 'bin', 'f2f']:
+        os.makedirs(os.path.join(workdir, sub))
+    shutil.copy(os.path.join(script_dir, 'dataInterface.py'), workdir)
+
+    key = Fernet.generate_key()
+    key_file_name = os.path.join(workdir, 'keyfile.key')
+    with open(key_file_name, 'wb') as key_file:
+        key_file.write(key)
+    f = Fernet(key)
+
+    #Source table for the cx_Oracle stand-in
+    columns = case['columns']
+    db_file = os.path.join(workdir, 'oracle.db')
+    db = sqlite3.connect(db_file)
+    #Declared with Oracle types, which the fake cursor reports in its description
+    col_defs = [name + ' ' + oracle_type for name, oracle_type in zip(columnNames(columns), oracleColumnTypes(columns, case['col_width']))]
+    db.execute('CREATE TABLE bench_data (' + ', '.join(col_defs) + ')')
+    db.executemany('INSERT INTO bench_data VALUES (' + ','.join(['?'] * columns) + ')',
+                   (makeRow(n, columns, case['col_width']) for n in range(1, case['rows'] + 1)))
+    db.commit()
+    db.close()
+
+    #sqlplus stand-in
+    sqlplus = os.path.join(workdir, 'bin', 'sqlplus')
+    with open(sqlplus, 'w') as script:
+        script.write(FAKE_SQLPLUS.replace('{python}', sys.executable))
+    os.chmod(sqlplus, 0o755)
+
+    #Source folder for folder2folder copy
+    for i in range(case['f2f_files']):
+        sub = os.path.join(workdir, 'f2f', 'sub' + str(i % 4))
+        if not os.path.isdir(sub):
+            os.makedirs(sub)
+        with open(os.path.join(sub, 'file_' + str(i) + '.log'), 'w') as f2f_file:
+            f2f_file.write(('log line ' + str(i) + '\n') * 1000)
+
+    #diConfig.ini: [DEFAULT] from the real config file plus a benchmark section
+    config = configparser.ConfigParser()
+    config.read(os.path.join(script_dir, 'diConfig.ini'))
+    for section in config.sections():
+        config.remove_section(section)
+    config.add_section(BENCH_SECTION)
+    settings = {
+        'log_file_dir': os.path.join(workdir, 'logs'),
+        'key_file_name': key_file_name,
+        's3_region_name': REGION,
+        's3_bucket_name': DATA_BUCKET,
+        's3_backup_bucket_name': BACKUP_BUCKET,
+        'aws_access_key_id': 'testing',
+        'aws_secret_access_key': f.encrypt(b'testing').decode(),
+        'oracle_password': f.encrypt(b'bench').decode(),
+        'oracle_spooling': 'false',
+        'oracle_sqlplus_connection': 'true' if case['connection'] == 'sqlplus' else 'false',
+        'outputfile_format_delimiter': ',',
+        'outputfile_format_quote': 'QUOTE_MINIMAL',
+        'outputfile_format': case['output_format'],
+        'parquet_unconstrained_number': case['unconstrained_number'],
+        'outputfile_chunk_rows': str(case['chunk_rows']),
+        'outputfile_chunk_mb': str(case['chunk_mb']),
+        's3_key_layout': case['key_layout'],
+        's3_key_shards': str(case['key_shards']),
+        's3_file_compress': 'true',
+        's3_backup': 'true',
+        'local_backup': 'true',
+        'local_backup_basefolder_name': os.path.join(workdir, 'backup'),
+        'folder2folder_copy': 'true' if case['f2f_files'] > 0 else 'false',
+        'folder2folder_source_folder': os.path.join(workdir, 'f2f'),
+        'folder2folder_target_s3_basefolder': 'bench/misc',
+    }
+    file_extn = '.parquet' if case['output_format'] == 'parquet' else '.dat'
+    for n in range(1, case['files'] + 1):
+        settings['sql_stmt_' + str(n)] = 'SELECT ' + ','.join(columnNames(columns)) + ' FROM bench_data'
+        settings['outputfile_of_sql_stmt_' + str(n)] = os.path.join(workdir, 'data', 'bench_' + str(n) + file_extn)
+        settings['s3_folder_name_' + str(n)] = 'bench/folder_' + str(n)
+    for name, value in settings.items():
+        #configparser treats % as interpolation syntax
+        config.set(BENCH_SECTION, name, value.replace('%', '%%'))
+    with open(os.path.join(workdir, 'diConfig.ini'), 'w') as config_file:
+        config.write(config_file)
+
+    with open(os.path.join(workdir, 'case.json'), 'w') as case_file:
+        json.dump(case, case_file)
+
+
+def timeStage(stages, stage_name, stage_func, nbytes=None, nrows=None):
+    #Run one stage and record its latency, throughput and the process' peak RSS during it.
+    #nbytes/nrows may be callables when the amount of data is only known after the stage ran.
+    rss_was_reset = resetPeakRss()
+    start = time.perf_counter()
+    stage_func()
+    elapsed = time.perf_counter() - start
+    stage = {'latency_s': elapsed}
+    if rss_was_reset:
+        stage['peak_rss_kb'] = peakRssKb()
+    if callable(nbytes):
+        nbytes = nbytes()
+    if callable(nrows):
+        nrows = nrows()
+    if nbytes is not None and elapsed > 0:
+        stage['mb_per_s'] = nbytes / 1000000.0 / elapsed
+    if nrows is not None and elapsed > 0:
+        stage['rows_per_s'] = nrows / elapsed
+    stages[stage_name] = stage
+
+
+def countRows(file_name, output_format, header):
+    #Rows in one extracted file, counted from the file itself rather than taken from dataInterface
+    if output_format == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.read_metadata(file_name).num_rows
+    with open(file_name) as data_file:
+        lines = sum(1 for line in data_file)
+    return lines - 1 if header else lines
+
+
+def expectedParquetTypes(case):
+    #Arrow types the Oracle column types of bench_data must be written as (see dataInterface.arrowTypeFromCursor())
+    unconstrained_number = re.sub(r'decimal\((\d+),(\d+)\)', r'decimal128(\1, \2)', case['unconstrained_number'])
+    parquet_types = {'NUMBER(18,0)': 'int64', 'NUMBER': unconstrained_number, 'DATE': 'timestamp[us]', 'CLOB': 'string', 'NUMBER(12,2)': 'decimal128(12, 2)'}
+    return [parquet_types.get(oracle_type, 'string') for oracle_type in oracleColumnTypes(case['columns'], case['col_width'])]
+
+
+def checkExtract(a, case):
+    #Every output file (or its parts) must hold exactly case['rows'] rows. Parquet columns must have the expected types.
+    problems = []
+    for file_name in sorted(a._sql_output_file_dict.values()):
+        if a._output_chunking:
+            part_files = sorted(glob.glob(a.getChunkFilePattern(file_name)))
+        else:
+            part_files = [file_name] if os.path.isfile(file_name) else []
+        if len(part_files) == 0:
+            problems.append('extract: no output file %s' % file_name)
+            continue
+        if case['output_format'] == 'parquet':
+            import pyarrow.parquet as pq
+            for part_file in part_files:
+                parquet_types = [str(field.type) for field in pq.read_schema(part_file)]
+                if parquet_types != expectedParquetTypes(case):
+                    problems.append('extract: %s has column types %s, expected %s' % (part_file, parquet_types, expectedParquetTypes(case)))
+        rows = sum(countRows(part_file, case['output_format'], a._file_fmt_header) for part_file in part_files)
+        if rows != case['rows']:
+            problems.append('extract: %s has %d rows in %d file(s), expected %d' % (file_name, rows, len(part_files), case['rows']))
+    return problems
+
+
+def checkLocalBackup(a, case):
+    #Every output file (or part) must be in the local backup folder of today: gzipped, or as is for Parquet
+    problems = []
+    backup_folder = os.path.join(a._local_backup_basefolder_name, a._curr_year, a._curr_month, a._curr_day)
+    for file_name in sorted(a._sql_output_file_dict.values()):
+        part_files = sorted(glob.glob(a.getChunkFilePattern(file_name))) if a._output_chunking else [file_name]
+        for part_file in part_files:
+            if case['output_format'] == 'parquet':
+                backup_file = os.path.join(backup_folder, a.stripFilenameFromPath(part_file))
+                if not os.path.isfile(backup_file) or os.path.getsize(backup_file) != os.path.getsize(part_file):
+                    problems.append('local_backup: no copy of %s at %s' % (part_file, backup_file))
+                continue
+            backup_file = os.path.join(backup_folder, a.stripFilenameFromPath(part_file) + '.gz')
+            if not os.path.isfile(backup_file):
+                problems.append('local_backup: no backup of %s at %s' % (part_file, backup_file))
+                continue
+            with gzip.open(backup_file, 'rb') as backup:
+                backup_bytes = len(backup.read())
+            if backup_bytes != os.path.getsize(part_file):
+                problems.append('local_backup: %s holds %d bytes, expected %d' % (backup_file, backup_bytes, os.path.getsize(part_file)))
+    return problems
+
+
+def objectExists(s3, bucket, key):
+    from botocore.exceptions import ClientError
+    try:
+        s3.head_object(Bucket=bucket, Key=key)
+    except ClientError:
+        return False
+    return True
+
+
+def checkKeys(a, s3, bucket, s3_basefolder, logical_keys, what):
+    #Each logical key must resolve to an existing object. With hashed layout it must also be in the key index.
+    problems = []
+    indexes = {}
+    for logical_key in logical_keys:
+        if a._s3_key_layout == 'hashed':
+            index_prefix = a.getS3KeyIndexPrefix(s3_basefolder, logical_key)
+            if index_prefix not in indexes:
+                indexes[index_prefix] = a.getS3KeyIndex(bucket, index_prefix)
+            if logical_key not in indexes[index_prefix]:
+                problems.append('%s: %s is not in the key index under %s' % (what, logical_key, index_prefix))
+        physical_key = a.findPhysicalS3Key(bucket, s3_basefolder, logical_key)
+        if not objectExists(s3, bucket, physical_key):
+            problems.append('%s: no object %s in bucket %s' % (what, physical_key, bucket))
+    return problems
+
+
+def checkS3(a, case, s3, seeded, f2f_folder):
+    #Data objects (or manifest and parts), backups of the seeded objects and folder2folder copies must all be in the mocked buckets
+    problems = []
+    for folder_name, file_name in seeded:
+        no_path_filename = a.stripFilenameFromPath(file_name)
+        if a._output_chunking:
+            manifest_key = folder_name + '/' + no_path_filename + '.manifest.json'
+            if not objectExists(s3, DATA_BUCKET, manifest_key):
+                problems.append('upload: no manifest %s' % manifest_key)
+                continue
+            manifest = json.loads(s3.get_object(Bucket=DATA_BUCKET, Key=manifest_key)['Body'].read().decode('utf-8'))
+            if manifest['total_rows'] != case['rows']:
+                problems.append('upload: manifest %s has total_rows %d, expected %d' % (manifest_key, manifest['total_rows'], case['rows']))
+            for part in manifest['parts']:
+                if not objectExists(s3, DATA_BUCKET, part['key']):
+                    problems.append('upload: no part %s listed in %s' % (part['key'], manifest_key))
+        else:
+            data_key = folder_name + '/' + no_path_filename + a.getUploadExtension(file_name)
+            if not objectExists(s3, DATA_BUCKET, data_key):
+                problems.append('upload: no object %s' % data_key)
+
+    #Same target keys as backupS3Objects(): chunked output keeps the source key under the date folder, otherwise the date goes into the filename
+    date_folder = a._curr_year + '/' + a._curr_month + '/' + a._curr_day
+    backup_keys = []
+    for folder_name, file_name in seeded:
+        if a._output_chunking:
+            no_path_filename = a.stripFilenameFromPath(a.getChunkFileName(file_name, 1))
+            backup_keys.append(a._s3_backup_basefolder_name + '/' + date_folder + '/' + folder_name + '/' + no_path_filename + a.getUploadExtension(file_name))
+        else:
+            no_path_filename = a.stripFilenameFromPath(file_name)
+            backup_keys.append(a._s3_backup_basefolder_name + '/' + date_folder + '/' + folder_name + '/' + no_path_filename.split('.')[0] + '.' + date_folder.replace('/', '.') + '.' + no_path_filename.split('.')[-1] + a.getUploadExtension(file_name))
+    problems += checkKeys(a, s3, BACKUP_BUCKET, a._s3_backup_basefolder_name, backup_keys, 's3_backup')
+
+    if case['f2f_files'] > 0:
+        f2f_keys = []
+        for curr_path, subfolders, files_in_curr_path in os.walk(f2f_folder):
+            for each_file in files_in_curr_path:
+                relative_folder = os.path.relpath(curr_path, os.path.dirname(f2f_folder)).replace(os.sep, '/')
+                f2f_keys.append(a._folder2folder_target_s3_basefolder + '/' + date_folder + '/' + relative_folder + '/' + each_file + a.getUploadExtension(os.path.join(curr_path, each_file)))
+        if len(f2f_keys) != case['f2f_files']:
+            problems.append('folder2folder: %d source files, expected %d' % (len(f2f_keys), case['f2f_files']))
+        problems += checkKeys(a, s3, DATA_BUCKET, a._folder2folder_target_s3_basefolder, f2f_keys, 'folder2folder')
+        copied = [key for key in a.listS3Keys(DATA_BUCKET, a._folder2folder_target_s3_basefolder + '/') if '/_key_index/' not in key]
+        if len(copied) != case['f2f_files']:
+            problems.append('folder2folder: %d objects under %s, expected %d' % (len(copied), a._folder2folder_target_s3_basefolder, case['f2f_files']))
+    return problems
+
+
+def runCase(workdir):
+    #Runs in the child process. Mirrors diCaller.main() one stage at a time.
+    with open(os.path.join(workdir, 'case.json')) as case_file:
+        case = json.load(case_file)
+
+    os.environ['PATH'] = os.path.join(workdir, 'bin') + os.pathsep + os.environ.get('PATH', '')
+    os.environ['DI_BENCH_DB'] = os.path.join(workdir, 'oracle.db')
+    for var in ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SECURITY_TOKEN', 'AWS_SESSION_TOKEN']:
+        os.environ[var] = 'testing'
+    os.environ['AWS_DEFAULT_REGION'] = REGION
+    installFakeCxOracle(os.path.join(workdir, 'oracle.db'))
+    sys.path.insert(0, workdir)
+
+    import boto3
+    import dataInterface as di
+
+    mock = mockAws()
+    mock.start()
+    try:
+        s3 = boto3.client('s3', region_name=REGION)
+        for bucket in [DATA_BUCKET, BACKUP_BUCKET]:
+            s3.create_bucket(Bucket=bucket, CreateBucketConfiguration={'LocationConstraint': REGION})
+
+        a = di.dataInterface(BENCH_SECTION)
+        data_folder = os.path.join(workdir, 'data')
+
+        #Objects from a "previous run" for backupS3Objects() to copy
+        seed_bytes = 0
+        seeded = []
+        for name, folder_name in a._s3_folder_dict.items():
+            file_name = a._sql_output_file_dict['outputfile_of_sql_stmt_' + name.split('_')[3]]
+            seeded.append((folder_name, file_name))
+            #Chunked output backs up last run's parts. A part gets the same upload extension as its file.
+            seed_file_name = a.getChunkFileName(file_name, 1) if a._output_chunking else file_name
+            body = os.urandom(case['seed_kb'] * 1024)
+            s3.put_object(Bucket=DATA_BUCKET, Key=folder_name + '/' + a.stripFilenameFromPath(seed_file_name) + a.getUploadExtension(file_name), Body=body)
+            seed_bytes += len(body)
+
+        stages = {}
+        def connectOracle():
+            a.decryptToken(a._oracle_password_token)
+            a.connectToOracleDB()
+        def connectS3():
+            a.decryptToken(a._aws_secret_access_key_token)
+            a.connectToS3()
+        total_rows = case['rows'] * case['files']
+        #With chunked output, extract includes loading the parts to S3 and upload has nothing left to do
+        timeStage(stages, 'connect_oracle', connectOracle)
+        timeStage(stages, 'connect_s3', connectS3)
+        timeStage(stages, 's3_backup', a.backupS3Objects, nbytes=seed_bytes)
+        timeStage(stages, 'extract', a.extractOracleToFile, nbytes=lambda: folderBytes(data_folder), nrows=total_rows)
+        #Row counts are checked right away, before the later stages compress or move the files
+        problems = checkExtract(a, case)
+        output_bytes = folderBytes(data_folder)
+        if a._output_chunking:
+            timeStage(stages, 'upload', a.writeObjectsToS3)
+        else:
+            timeStage(stages, 'upload', a.writeObjectsToS3, nbytes=output_bytes, nrows=total_rows)
+        timeStage(stages, 'local_backup', a.backupLocalFiles, nbytes=output_bytes)
+        problems += checkLocalBackup(a, case)
+        timeStage(stages, 'folder2folder', a.writeLocalFolderToS3Folder, nbytes=folderBytes(os.path.join(workdir, 'f2f')))
+        problems += checkS3(a, case, s3, seeded, os.path.join(workdir, 'f2f'))
+        if problems:
+            raise RuntimeError('Checks of case %s failed:\n' % caseName(case) + '\n'.join(problems))
+    finally:
+        mock.stop()
+    return stages
+
+
+def caseName(case):
+    name = '%s-r%d-f%d-c%dx%d' % (case['connection'], case['rows'], case['files'], case['columns'], case['col_width'])
+    if case['output_format'] != 'delimited':
+        name += '-' + case['output_format']
+    if case['output_format'] == 'parquet' and case['unconstrained_number'] != DEFAULT_UNCONSTRAINED_NUMBER:
+        name += '-' + re.sub(r'\W+', '', case['unconstrained_number'])
+    if case['chunk_rows'] > 0:
+        name += '-chunk%dr' % case['chunk_rows']
+    if case['chunk_mb'] > 0:
+        name += '-chunk%gmb' % case['chunk_mb']
+    if case['key_layout'] != 'date':
+        name += '-%s%d' % (case['key_layout'], case['key_shards'])
+    return name
+
+
+def runCaseInChild(case, repeat, keep):
+    #Fresh process per repetition so peak RSS and logging don't carry over between runs.
+    runs = []
+    for i in range(repeat):
+        workdir = tempfile.mkdtemp(prefix='dibench_')
+        try:
+            prepareWorkdir(case, workdir)
+            child = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', workdir],
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            if child.returncode != 0:
+                raise RuntimeError('Benchmark case %s failed (work directory %s):\n%s' % (caseName(case), workdir, child.stderr))
+            runs.append(json.loads(child.stdout.strip().splitlines()[-1]))
+        finally:
+            if keep:
+                print('Kept work directory', workdir)
+            else:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    #Median of each metric across repetitions
+    result = {}
+    for stage_name in runs[0]:
+        result[stage_name] = {}
+        for metric in sorted(set(itertools.chain.from_iterable(run[stage_name] for run in runs))):
+            values = [run[stage_name][metric] for run in runs if run[stage_name].get(metric) is not None]
+            if values:
+                result[stage_name][metric] = statistics.median(values)
+    return result
+
+
+def compareWithBaseline(results, baseline, tolerance, min_latency):
+    #Latency and RSS may grow by at most tolerance, throughput may drop by at most tolerance.
+    #Latencies below min_latency seconds are too noisy to compare.
+    regressions = []
+    for name, stages in results.items():
+        if name not in baseline:
+            continue
+        for stage_name, metrics in stages.items():
+            base = baseline[name].get(stage_name)
+            if base is None:
+                continue
+            for metric, value in metrics.items():
+                base_value = base.get(metric)
+                if value is None or not base_value:
+                    continue
+                if metric in ['latency_s', 'mb_per_s', 'rows_per_s'] and max(base['latency_s'], metrics['latency_s']) < min_latency:
+                    continue
+                if metric in ['latency_s', 'peak_rss_kb']:
+                    regressed = value > base_value * (1 + tolerance)
+                else:
+                    regressed = value < base_value * (1 - tolerance)
+                if regressed:
+                    regressions.append('%s %s %s: %.4g (baseline %.4g, %+.1f%%)' % (name, stage_name, metric, value, base_value, (value / base_value - 1) * 100))
+    return regressions
+
+
+def printResults(results):
+    print('%-32s %-15s %10s %10s %12s %12s' % ('case', 'stage', 'latency_s', 'MB/s', 'rows/s', 'peak_rss_kb'))
+    for name, stages in results.items():
+        for stage_name, m in stages.items():
+            print('%-32s %-15s %10.4f %10s %12s %12s' % (name, stage_name, m['latency_s'],
+                  '%.2f' % m['mb_per_s'] if m.get('mb_per_s') is not None else '-',
+                  '%.0f' % m['rows_per_s'] if m.get('rows_per_s') is not None else '-',
+                  m['peak_rss_kb'] if m.get('peak_rss_kb') is not None else '-'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark dataInterface against local S3, Oracle and SQL*Plus stand-ins.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000], help='rows per SQL statement')
+    parser.add_argument('--files', type=int, nargs='+', default=[1, 4], help='number of sql_stmt_N/output files')
+    parser.add_argument('--columns', type=int, nargs='+', default=[8, 32], help='columns per row (min 2)')
+    parser.add_argument('--col-width', type=int, nargs='+', default=[16], help='characters per text column')
+    parser.add_argument('--connection', nargs='+', default=['cx_oracle', 'sqlplus'], choices=['cx_oracle', 'sqlplus'])
+    parser.add_argument('--output-format', nargs='+', default=['delimited'], choices=['delimited', 'parquet'],
+                        help='outputfile_format. parquet cases are skipped for sqlplus, which only writes delimited text')
+    parser.add_argument('--unconstrained-number', nargs='+', default=[DEFAULT_UNCONSTRAINED_NUMBER],
+                        help='parquet_unconstrained_number (string, double or decimal(p,s)). Only varies parquet cases')
+    parser.add_argument('--chunk-rows', type=int, nargs='+', default=[0], help='outputfile_chunk_rows (0 = one file per SQL)')
+    parser.add_argument('--chunk-mb', type=float, nargs='+', default=[0], help='outputfile_chunk_mb (0 = no size limit)')
+    parser.add_argument('--key-layout', nargs='+', default=['date'], choices=['date', 'hashed'], help='s3_key_layout for backups and folder2folder')
+    parser.add_argument('--key-shards', type=int, default=16, help='s3_key_shards for hashed key layout')
+    parser.add_argument('--f2f-files', type=int, default=50, help='files in the folder2folder source folder')
+    parser.add_argument('--seed-kb', type=int, default=1024, help='size of each pre-existing S3 object to back up')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case, the median is reported')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help='store results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative regression (0.25 = 25%%)')
+    parser.add_argument('--min-latency', type=float, default=0.05, help='ignore timing changes of stages faster than this (seconds)')
+    parser.add_argument('--keep', action='store_true', help='keep work directories for inspection')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(runCase(args.child)))
+        return 0
+
+    results = {}
+    for connection, output_format, unconstrained_number, chunk_rows, chunk_mb, key_layout, rows, files, columns, col_width in itertools.product(args.connection, args.output_format, args.unconstrained_number, args.chunk_rows, args.chunk_mb, args.key_layout, args.rows, args.files, args.columns, args.col_width):
+        if connection == 'sqlplus' and output_format == 'parquet':
+            continue
+        if output_format != 'parquet' and unconstrained_number != args.unconstrained_number[0]:
+            continue
+        case = {'connection': connection, 'output_format': output_format, 'unconstrained_number': unconstrained_number.lower().replace(' ', ''), 'chunk_rows': chunk_rows, 'chunk_mb': chunk_mb,
+                'key_layout': key_layout, 'key_shards': args.key_shards, 'rows': rows, 'files': files, 'columns': max(columns, 2),
+                'col_width': col_width, 'f2f_files': args.f2f_files, 'seed_kb': args.seed_kb}
+        print('Running', caseName(case), '..', file=sys.stderr)
+        results[caseName(case)] = runCaseInChild(case, args.repeat, args.keep)
+    printResults(results)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.isfile(args.baseline):
+            with open(args.baseline) as baseline_file:
+                baseline = json.load(baseline_file)
+        baseline.setdefault('cases', {}).update(results)
+        baseline['platform'] = platform.platform()
+        baseline['python'] = platform.python_version()
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        print('Baseline saved to', args.baseline)
+        return 0
+
+    if not os.path.isfile(args.baseline):
+        print('No baseline at %s. Run with --save-baseline to create one.' % args.baseline)
+        return 0
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compareWithBaseline(results, baseline.get('cases', {}), args.tolerance, args.min_latency)
+    for regression in regressions:
+        print('REGRESSION:', regression)
+    if not regressions:
+        print('No regressions against', args.baseline)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -48,10 +48,11 @@ def main():
     a = di.dataInterface(config_section)
     a.decryptToken(a._oracle_password_token)
     a.connectToOracleDB()
-    a.extractOracleToFile()
     a.decryptToken(a._aws_secret_access_key_token)
     a.connectToS3()
-    a.backupS3Objects()    
+    #Back up before extracting. With outputfile_chunk_rows/_mb set, parts are loaded to S3 (overwriting last run's) during extraction.
+    a.backupS3Objects()
+    a.extractOracleToFile()
     a.writeObjectsToS3()
     a.backupLocalFiles()
     a.writeLocalFolderToS3Folder()